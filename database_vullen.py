@@ -1,10 +1,21 @@
-import requests
-import xml.etree.ElementTree as ET
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import httpx
+import diskcache
+import functools
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
 from datetime import datetime, timedelta
 import time
+import io
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, LineString, MultiLineString, Polygon, MultiPolygon
+import shapely
 from shapely import wkt
 from sqlalchemy import create_engine, text
 from geoalchemy2 import Geometry, WKTElement
@@ -28,6 +39,8 @@ db_url = f'postgresql://{username}:{password}@{host}:{port}/{database_name}'
 
 geometry_bounds_wkt = config['api']['geometry_bounds']
 geometry_bounds = wkt.loads(geometry_bounds_wkt)
+# Prepare the bounds once, every containment test against them then reuses the GEOS index
+shapely.prepare(geometry_bounds)
 start_datum_str = config['api']['start_datum']
 
 # Convert start_datum to datetime
@@ -52,6 +65,46 @@ FIELDS_TO_EXTRACT = [
     'overheidwetgeving:organisatietype', 'overheidwetgeving:publicatienummer',
     'overheidwetgeving:publicatienaam'
 ]
+RECORD_TAG = f"{{{NAMESPACES['sru']}}}record"
+NUMBER_OF_RECORDS_TAG = f"{{{NAMESPACES['sru']}}}numberOfRecords"
+XML_PARSER = ET.XMLParser(huge_tree=True, recover=False) if HAS_LXML else None
+FIELD_COLUMNS = [field.split(':')[-1] for field in FIELDS_TO_EXTRACT]
+RECORD_COLUMNS = FIELD_COLUMNS + ['source', 'source_xml']
+GEOMETRY_COLUMNS = ['geometry', 'gebiedsmarkering_type', 'geometrieLabel']
+# Output column order, the geometry comes right after the extracted fields
+COLUMNS = FIELD_COLUMNS + ['geometry'] + [
+    column for column in RECORD_COLUMNS + GEOMETRY_COLUMNS if column not in FIELD_COLUMNS + ['geometry']
+]
+PAGE_SIZE = 1000
+MAX_CONCURRENT_PAGES = 16
+MAX_CONCURRENT_LOOKUPS = 32
+POINT_TYPES = [shapely.GeometryType.POINT]
+LINE_TYPES = [shapely.GeometryType.LINESTRING, shapely.GeometryType.LINEARRING, shapely.GeometryType.MULTILINESTRING]
+POLYGON_TYPES = [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.3
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTTP_TIMEOUT = httpx.Timeout(None, connect=5, read=30)
+HTTP_HEADERS = {'Accept': 'application/xml'}
+HTTP_CACHE = diskcache.Cache('.http_cache')
+HTTP_CACHE_EXPIRE = 30 * 24 * 60 * 60  # 30 days
+
+
+def compile_path(path):
+    """Compile a namespaced path once, returning a function that lists the matching elements."""
+    if HAS_LXML:
+        return ET.XPath(path, namespaces=NAMESPACES)
+    return lambda elem: elem.findall(path, NAMESPACES)
+
+
+FIELD_TAGS = {
+    f'{{{NAMESPACES[prefix]}}}{name}': name
+    for prefix, name in (field.split(':') for field in FIELDS_TO_EXTRACT)
+}
+HAS_VERSION_PATH = compile_path('.//dcterms:hasVersion')
+GEBIEDSMARKERING_PATH = compile_path('.//overheidwetgeving:gebiedsmarkering')
+GEOMETRIE_PATH = compile_path('.//overheidwetgeving:geometrie')
+GEOMETRIELABEL_PATH = compile_path('.//overheidwetgeving:geometrielabel')
 
 
 def timer_decorator(func):
@@ -65,132 +118,323 @@ def timer_decorator(func):
     return wrapper
 
 
-def validate_geometries(gdf):
-    """Validate geometries in a GeoDataFrame and remove invalid ones."""
-    valid_gdf = gdf[gdf.is_valid]
-    invalid_gdf = gdf[~gdf.is_valid]
-    print(f"Found {len(invalid_gdf)} invalid geometries out of {len(gdf)}. Removing invalid geometries.")
-    return valid_gdf
+def within_bounds(geometries, bounds):
+    """Test which geometries lie within the bounds.
 
+    An STRtree first selects the geometries whose envelope intersects the bounds, the exact test only runs on those.
+    The test is written as bounds contains geometries, so prepared bounds are used.
+    """
+    within = np.zeros(len(geometries), dtype=bool)
+    candidates = shapely.STRtree(geometries).query(bounds)
+    within[candidates] = shapely.contains(bounds, geometries[candidates])
+    return within
+
+
+def validate_geometries(df, bounds):
+    """Remove invalid geometries and geometries outside the bounds, only testing the bounds for valid ones."""
+    geometries = df['geometry'].to_numpy()
+    valid = shapely.is_valid(geometries)
+    within = np.zeros_like(valid)
+    within[valid] = within_bounds(geometries[valid], bounds)
+    print(f"Found {(~valid).sum()} invalid geometries out of {len(df)}. Removing invalid geometries.")
+    return df[valid & within]
+
+
+def create_session(limit):
+    """Create an HTTP client whose connections are kept alive and reused between requests.
+
+    HTTP/2 is negotiated when the server supports it, so concurrent requests share a single connection.
+    """
+    limits = httpx.Limits(max_connections=limit, max_keepalive_connections=limit, keepalive_expiry=60)
+    return httpx.AsyncClient(http2=True, limits=limits, timeout=HTTP_TIMEOUT, headers=HTTP_HEADERS,
+                             follow_redirects=True)
+
+
+async def get_with_retries(session, url, params=None):
+    """GET a URL, retrying connection errors and transient status codes with exponential backoff.
+
+    Returns the response of the last attempt, or None if no response was received at all.
+    """
+    for attempt in range(HTTP_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(HTTP_BACKOFF_FACTOR * (2 ** (attempt - 1)))  # Exponential backoff
+        try:
+            response = await session.get(url, params=params)
+        except httpx.HTTPError as e:
+            print(f"Error fetching {url}: {e}")
+            continue
+        if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+            return response
+    return None
+
+
+def create_columns():
+    return {column: [] for column in RECORD_COLUMNS + GEOMETRY_COLUMNS + ['record_index']}
+
+
+def merge_columns(columns, page_columns):
+    """Append the columns of a parsed page, shifting its record_index past the records collected so far."""
+    offset = len(columns['source_xml'])
+    columns['record_index'].extend(index + offset for index in page_columns['record_index'])
+    for column in RECORD_COLUMNS + GEOMETRY_COLUMNS:
+        columns[column].extend(page_columns[column])
+
+
+def iterparse_page(content):
+    source = io.BytesIO(content)
+    if HAS_LXML:
+        return ET.iterparse(source, events=('end',), tag=(RECORD_TAG, NUMBER_OF_RECORDS_TAG), huge_tree=True)
+    return ET.iterparse(source, events=('end',))
 
-@timer_decorator
-def fetch_records(start_date, end_date):
-    all_records = []
-    start_record = 1
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
 
-    while True:
-        params = {
-            'query': f"(c.product-area==officielepublicaties AND dt.modified>={start_date_str} AND dt.modified<={end_date_str})",
-            'startRecord': start_record,
-            'maximumRecords': 1000
-        }
-        response = requests.get(API_ENDPOINT, params=params)
+def clear_element(elem):
+    """Free a parsed element together with the already processed siblings before it."""
+    elem.clear()
+    if HAS_LXML:
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def parse_page(content, start_record):
+    """Parse a page of records, extracting each record as soon as it has been parsed.
+
+    Runs in a worker process, returns the number of records reported by the API and the extracted columns,
+    or None if the page could not be parsed.
+    """
+    number_of_records = 0
+    columns = create_columns()
+    try:
+        for _, elem in iterparse_page(content):
+            if elem.tag == NUMBER_OF_RECORDS_TAG:
+                number_of_records = int(elem.text)
+            elif elem.tag == RECORD_TAG:
+                extract_data(elem, columns)
+                clear_element(elem)
+    except Exception as e:
+        # Parser exceptions can not always be pickled back to the main process, so report the error here
+        print(f"Failed to parse records starting at {start_record}: {e}")
+        return None
+    return number_of_records, columns
+
+
+async def fetch_page(session, semaphore, params):
+    """Fetch a page of records, returning the response body or None if the page could not be fetched."""
+    async with semaphore:
+        response = await get_with_retries(session, API_ENDPOINT, params)
+        if response is None:
+            return None
         if response.status_code != 200:
-            break
+            print(f"Failed to fetch records starting at {params['startRecord']}, status code: {response.status_code}")
+            return None
+        return response.content
 
-        root = ET.fromstring(response.content)
-        records = root.findall('.//sru:record', NAMESPACES)
-        if not records:
-            break
 
-        for record in records:
-            extracted_data = extract_data(record)
-            all_records.extend(extracted_data)
+async def fetch_and_parse_page(session, semaphore, pool, params):
+    """Fetch a page of records and parse it in the process pool, so pages are parsed on all cores."""
+    content = await fetch_page(session, semaphore, params)
+    if content is None:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(pool, parse_page, content, params['startRecord'])
 
-        start_record += 1000
-        if len(records) < 1000:
-            break
 
-    print(f'Records fetched: {len(all_records)}')
+async def _fetch_records_async(start_date, end_date):
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+    query = f"(c.product-area==officielepublicaties AND dt.modified>={start_date_str} AND dt.modified<={end_date_str})"
+    params_template = {'query': query, 'maximumRecords': PAGE_SIZE}
+
+    # The columns grow page by page. numberOfRecords is not used to preallocate them, because it also counts
+    # the records without geometries, which are never stored.
+    columns = create_columns()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        async with create_session(MAX_CONCURRENT_PAGES) as session:
+            # The first page tells us how many records there are, the remaining pages are fetched concurrently
+            first_page = await fetch_and_parse_page(session, semaphore, pool, {**params_template, 'startRecord': 1})
+            if first_page is None:
+                raise RuntimeError("Failed to fetch the first page of records, stopping before the layers are written")
+
+            number_of_records, page_columns = first_page
+            merge_columns(columns, page_columns)
+            start_records = range(1 + PAGE_SIZE, number_of_records + 1, PAGE_SIZE)
+            pages = await asyncio.gather(*[
+                fetch_and_parse_page(session, semaphore, pool, {**params_template, 'startRecord': start_record})
+                for start_record in start_records
+            ])
+
+    # Writing an incomplete set of records would replace the layers with a partial copy, so fail the whole run instead
+    failed = [start_record for start_record, page in zip(start_records, pages) if page is None]
+    if failed:
+        raise RuntimeError(f"Failed to fetch the records starting at {failed}, stopping before the layers are written")
+    for _, page_columns in pages:
+        merge_columns(columns, page_columns)
+    return columns
+
+
+@timer_decorator
+def fetch_records(start_date, end_date):
+    all_records = asyncio.run(_fetch_records_async(start_date, end_date))
+    print(f'Records fetched: {len(all_records["geometry"])}')
     return all_records
 
 
-def extract_data(record):
-    base_data = {field.split(':')[-1]: None for field in FIELDS_TO_EXTRACT}
-    for field in FIELDS_TO_EXTRACT:
-        found_element = record.find(f'.//{field}', NAMESPACES)
-        if found_element is not None:
-            base_data[field.split(':')[-1]] = found_element.text
+def extract_data(record, columns):
+    """Append the geometries of a record to the columns.
 
-    has_version_element = record.find('.//dcterms:hasVersion', NAMESPACES)
+    The record fields are stored once per record, every geometry refers to them through its record_index.
+    Records without geometries are skipped entirely.
+    """
+    geometry_count = 0
+    for gebiedsmarkering in GEBIEDSMARKERING_PATH(record):
+        geom_type = gebiedsmarkering.tag.split('}')[1]
+        geometries = GEOMETRIE_PATH(gebiedsmarkering)
+        labels = GEOMETRIELABEL_PATH(gebiedsmarkering)
+        for geometry, label in zip(geometries, labels):
+            columns['geometry'].append(geometry.text)
+            columns['gebiedsmarkering_type'].append(geom_type)
+            columns['geometrieLabel'].append(label.text if label is not None else None)
+            geometry_count += 1
+
+    if not geometry_count:
+        return
+
+    # One pass over the record, keeping the first element of every field like find() would
+    base_data = {}
+    for elem in record.iter():
+        name = FIELD_TAGS.get(elem.tag)
+        if name is not None and name not in base_data:
+            base_data[name] = elem.text
+    for name in FIELD_TAGS.values():
+        base_data.setdefault(name, None)
+
+    has_version_elements = HAS_VERSION_PATH(record)
     identifier = base_data.get('identifier')
     source = None
-    if has_version_element is not None and 'resourceIdentifier' in has_version_element.attrib:
-        source = has_version_element.attrib['resourceIdentifier'].replace('.html', '')
+    if has_version_elements and 'resourceIdentifier' in has_version_elements[0].attrib:
+        source = has_version_elements[0].attrib['resourceIdentifier'].replace('.html', '')
 
-    source_xml = f"https://repository.overheid.nl/sru?&query=(dt.identifier={identifier})" if identifier else None
+    base_data['source'] = source + '.html' if source else None
+    base_data['source_xml'] = f"https://repository.overheid.nl/sru?&query=(dt.identifier={identifier})" if identifier else None
 
-    record_data = []
-    for gebiedsmarkering in record.findall('.//overheidwetgeving:gebiedsmarkering', NAMESPACES):
-        geom_type = gebiedsmarkering.tag.split('}')[1]
-        geometries = gebiedsmarkering.findall('.//overheidwetgeving:geometrie', NAMESPACES)
-        labels = gebiedsmarkering.findall('.//overheidwetgeving:geometrielabel', NAMESPACES)
-        for geometry, label in zip(geometries, labels):
-            geo_data = base_data.copy()
-            geo_data['geometry'] = geometry.text
-            geo_data['source'] = source + '.html' if source else None
-            geo_data['source_xml'] = source_xml
-            geo_data['gebiedsmarkering_type'] = geom_type
-            geo_data['geometrieLabel'] = label.text if label is not None else None
+    columns['record_index'].extend([len(columns['source_xml'])] * geometry_count)
+    for name, value in base_data.items():
+        columns[name].append(value)
 
-            record_data.append(geo_data)
-    return record_data
 
+def build_dataframe(columns):
+    """Build a DataFrame with a row per geometry, repeating the record fields for each geometry of a record."""
+    record_index = np.asarray(columns['record_index'], dtype=np.intp)
+    data = {column: np.asarray(columns[column], dtype=object)[record_index] for column in RECORD_COLUMNS}
+    data.update({column: columns[column] for column in GEOMETRY_COLUMNS})
+    return pd.DataFrame(data, columns=COLUMNS)
 
-def fetch_metadata_url(source_xml_url, retries=3, backoff_factor=0.3):
-    attempt = 0
-    while attempt < retries:
-        try:
-            response = requests.get(source_xml_url)
-            if response.status_code == 200:
-                root = ET.fromstring(response.content)
-                metadata_url_element = root.find('.//gzd:itemUrl[@manifestation="metadata"]', NAMESPACES)
-                if metadata_url_element is not None:
-                    return metadata_url_element.text
-                else:
-                    print(f"No metadata URL found in source XML for URL: {source_xml_url}")
-            else:
-                print(f"Failed to fetch source XML from {source_xml_url}, status code: {response.status_code}")
-        except Exception as e:
-            print(f"Error fetching metadata URL from {source_xml_url}: {e}")
-            time.sleep(backoff_factor * (2 ** attempt))  # Exponential backoff
-        attempt += 1
+
+def cache_lookup(func):
+    """Cache the results of a URL lookup in memory and on disk, so known URLs are not requested again."""
+    results = {}
+
+    @functools.wraps(func)
+    async def wrapper(session, url):
+        if url not in results:
+            key = (func.__name__, url)
+            result = HTTP_CACHE.get(key)
+            if result is None:
+                result = await func(session, url)
+                if result is not None:
+                    HTTP_CACHE.set(key, result, expire=HTTP_CACHE_EXPIRE)
+            results[url] = result
+        return results[url]
+
+    return wrapper
+
+
+@cache_lookup
+async def fetch_metadata_url(session, source_xml_url):
+    try:
+        response = await get_with_retries(session, source_xml_url)
+        if response is None:
+            return None
+        if response.status_code != 200:
+            print(f"Failed to fetch source XML from {source_xml_url}, status code: {response.status_code}")
+            return None
+        root = ET.fromstring(response.content, parser=XML_PARSER)
+    except Exception as e:
+        print(f"Error fetching metadata URL from {source_xml_url}: {e}")
+        return None
+
+    metadata_url_element = root.find('.//gzd:itemUrl[@manifestation="metadata"]', NAMESPACES)
+    if metadata_url_element is not None:
+        return metadata_url_element.text
+    print(f"No metadata URL found in source XML for URL: {source_xml_url}")
     return None
 
 
-def fetch_referentienummer(metadata_url, retries=3, backoff_factor=0.3):
-    attempt = 0
-    while attempt < retries:
-        try:
-            response = requests.get(metadata_url)
-            if response.status_code == 200:
-                root = ET.fromstring(response.content)
-                referentienummer_element = root.find('.//metadata[@name="OVERHEIDop.referentienummer"]')
-                if referentienummer_element is not None:
-                    return referentienummer_element.attrib.get('content')
-            else:
-                print(f"Failed to fetch metadata from {metadata_url}, status code: {response.status_code}")
-        except Exception as e:
-            print(f"Error fetching referentienummer from {metadata_url}: {e}")
-            time.sleep(backoff_factor * (2 ** attempt))  # Exponential backoff
-        attempt += 1
+@cache_lookup
+async def fetch_referentienummer(session, metadata_url):
+    try:
+        response = await get_with_retries(session, metadata_url)
+        if response is None:
+            return None
+        if response.status_code != 200:
+            print(f"Failed to fetch metadata from {metadata_url}, status code: {response.status_code}")
+            return None
+        root = ET.fromstring(response.content, parser=XML_PARSER)
+    except Exception as e:
+        print(f"Error fetching referentienummer from {metadata_url}: {e}")
+        return None
+
+    referentienummer_element = root.find('.//metadata[@name="OVERHEIDop.referentienummer"]')
+    if referentienummer_element is not None:
+        return referentienummer_element.attrib.get('content')
     return None
 
 
+async def _fetch_metadata_async(source_xml_urls):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+
+    async def resolve(source_xml):
+        async with semaphore:
+            metadata_url = await fetch_metadata_url(session, source_xml)
+            referentienummer = await fetch_referentienummer(session, metadata_url) if metadata_url else None
+        return source_xml, metadata_url, referentienummer
+
+    async with create_session(MAX_CONCURRENT_LOOKUPS) as session:
+        return await asyncio.gather(*[resolve(source_xml) for source_xml in source_xml_urls])
+
+
+@timer_decorator
+def fetch_metadata(source_xml_urls):
+    """Fetch the metadata URL and referentienummer for every source XML URL."""
+    metadata_dict = {}
+    referentienummer_dict = {}
+
+    for source_xml, metadata_url, referentienummer in asyncio.run(_fetch_metadata_async(source_xml_urls)):
+        if metadata_url:
+            metadata_dict[source_xml] = metadata_url
+            referentienummer_dict[metadata_url] = referentienummer
+    return metadata_dict, referentienummer_dict
+
+
 @timer_decorator
 def parse_geometries(df):
-    df['geometry'] = df['geometry'].apply(parse_geometry)
-    return df
+    """Parse all WKT geometries in one vectorized call and drop the ones that could not be parsed."""
+    df['geometry'] = shapely.from_wkt(df['geometry'].to_numpy(dtype=object, na_value=None), on_invalid='ignore')
+    parsed = df['geometry'].notna()
+    print(f"Failed to parse {(~parsed).sum()} geometries out of {len(df)}.")
+    return df[parsed]
 
 
-def parse_geometry(geo_str):
-    try:
-        return wkt.loads(geo_str)
-    except Exception as e:
-        print("Failed to parse geometry:", geo_str, "Error:", e)
-        return None
+def split_geometry_types(df):
+    """Split the rows into point, line and polygon GeoDataFrames with a single groupby on the geometry type."""
+    groups = {type_id: group for type_id, group in df.groupby(shapely.get_type_id(df['geometry'].to_numpy()))}
+    empty = df.iloc[:0]
+
+    split_gdfs = []
+    for type_ids in [POINT_TYPES, LINE_TYPES, POLYGON_TYPES]:
+        parts = [groups[type_id] for type_id in type_ids if type_id in groups]
+        split_gdfs.append(gpd.GeoDataFrame(pd.concat(parts) if parts else empty, geometry='geometry',
+                                           crs='EPSG:28992'))
+    return split_gdfs
 
 
 @timer_decorator
@@ -198,6 +442,7 @@ def write_to_postgis(gdf, layer_name, db_url, schema='geo'):
     engine = create_engine(db_url)
     gdf.columns = map(str.lower, gdf.columns)
     print(f"Columns being written to {layer_name}: {gdf.columns}")
+    # GeoPandas already streams the rows in with COPY, in the same transaction in which it creates the table
     gdf.to_postgis(name=layer_name, con=engine, schema=schema, if_exists='replace', index=False,
                    dtype={'geometry': Geometry(geometry_type='GEOMETRY', srid=28992)})
     print(f'Writing to PostGIS layer: {layer_name}')
@@ -209,51 +454,28 @@ def main():
 
     records = fetch_records(start_date, end_date)
 
-    df = pd.DataFrame(records)
+    df = build_dataframe(records)
     df = parse_geometries(df)
 
-    gdf_points = gpd.GeoDataFrame(df[df['geometry'].apply(lambda x: isinstance(x, Point))], geometry='geometry',
-                                  crs='EPSG:28992')
-    gdf_lines = gpd.GeoDataFrame(df[df['geometry'].apply(lambda x: isinstance(x, (LineString, MultiLineString)))],
-                                 geometry='geometry', crs='EPSG:28992')
-    gdf_polygons = gpd.GeoDataFrame(df[df['geometry'].apply(lambda x: isinstance(x, (Polygon, MultiPolygon)))],
-                                    geometry='geometry', crs='EPSG:28992')
-
     print(f'Processing PostGIS layers')
 
-    # Validate and clean geometries
-    gdf_points = validate_geometries(gdf_points)
-    gdf_lines = validate_geometries(gdf_lines)
-    gdf_polygons = validate_geometries(gdf_polygons)
-
-    # Filter based on geometry bounds
-    gdf_points_within = gdf_points[gdf_points.within(geometry_bounds)]
-    gdf_lines_within = gdf_lines[gdf_lines.within(geometry_bounds)]
-    gdf_polygons_within = gdf_polygons[gdf_polygons.within(geometry_bounds)]
+    # Remove invalid geometries and geometries outside the geometry bounds
+    df = validate_geometries(df, geometry_bounds)
 
     # Fetch metadata URL and referentienummer for filtered geometries
-    unique_source_xmls = gdf_points_within['source_xml'].dropna().unique().tolist() + \
-                         gdf_lines_within['source_xml'].dropna().unique().tolist() + \
-                         gdf_polygons_within['source_xml'].dropna().unique().tolist()
-    unique_source_xmls = list(set(unique_source_xmls))  # Get unique URLs
-
-    metadata_dict = {}
-    referentienummer_dict = {}
-
-    for source_xml in unique_source_xmls:
-        metadata_url = fetch_metadata_url(source_xml)
-        if metadata_url:
-            metadata_dict[source_xml] = metadata_url
-            referentienummer_dict[source_xml] = fetch_referentienummer(metadata_url)
-
-    for gdf in [gdf_points_within, gdf_lines_within, gdf_polygons_within]:
-        gdf.loc[:, 'metadata_url'] = gdf['source_xml'].map(metadata_dict)
-        gdf.loc[:, 'referentienummer'] = gdf['metadata_url'].map(referentienummer_dict)
-
-    # Write to PostGIS
-    write_to_postgis(gdf_points_within, layer_point, db_url, schema)
-    write_to_postgis(gdf_lines_within, layer_line, db_url, schema)
-    write_to_postgis(gdf_polygons_within, layer_polygon, db_url, schema)
+    unique_source_xmls = df['source_xml'].dropna().unique().tolist()
+    metadata_dict, referentienummer_dict = fetch_metadata(unique_source_xmls)
+    df = df.assign(metadata_url=lambda d: d['source_xml'].map(metadata_dict),
+                   referentienummer=lambda d: d['metadata_url'].map(referentienummer_dict))
+
+    gdf_points_within, gdf_lines_within, gdf_polygons_within = split_geometry_types(df)
+
+    # Write to PostGIS, the layers are separate tables so they are written concurrently
+    layers = [(gdf_points_within, layer_point), (gdf_lines_within, layer_line), (gdf_polygons_within, layer_polygon)]
+    with ThreadPoolExecutor(max_workers=len(layers)) as executor:
+        futures = [executor.submit(write_to_postgis, gdf, layer_name, db_url, schema) for gdf, layer_name in layers]
+        for future in futures:
+            future.result()
 
     print("Data fetching, saving, processing, and database writing completed successfully.")
 